@@ -0,0 +1,110 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from scipy import sparse
+
+from src.magmerge.merge_mag import (
+    contig2bin_frame,
+    coverage_frame,
+    join_coverage_bins,
+    sample_keyed,
+)
+
+
+def prepare_abundance_matrix(
+    df_cov: pd.DataFrame, df_bin: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Builds MAG × sample read counts and relative abundances as sparse matrices
+    (no dense pivot of the long-form table).
+    Expected inputs:
+    - df_cov: columns at least ['rname','endpos','numreads','sample_id']
+    - df_bin: columns at least ['contig','bin']; with 'sample_id' (per-sample assemblies, as
+      returned by pipeline_Binning) contigs are matched within their sample and MAGs are keyed
+      by (sample_id, mag_id); without it df_bin is a dereplicated catalog and MAGs by mag_id
+    Returns (reads, relative_abundance): sparse DataFrames indexed by MAG with one column
+    per sample_id; relative abundance = reads in bin / reads mapped to bins in the sample.
+    """
+    cov = coverage_frame(df_cov)
+    if "sample_id" not in cov.columns:
+        raise ValueError("Coverage has no 'sample_id' column, cannot build a MAG × sample matrix.")
+    contig2bin = contig2bin_frame(df_bin)
+    keyed = sample_keyed(cov, contig2bin)
+    cov_bin = join_coverage_bins(cov, contig2bin)
+
+    reads_per = cov_bin.groupby(["bin", "sample_id"], as_index=False)["numreads"].sum()
+
+    # row/column positions from the sorted unique ids
+    if keyed:
+        row_keys = pd.MultiIndex.from_frame(
+            reads_per[["sample_id", "bin"]], names=["sample_id", "mag_id"]
+        )
+    else:
+        row_keys = pd.Index(reads_per["bin"], name="mag_id")
+    mag_ids = row_keys.unique().sort_values()
+    sample_ids = pd.Index(reads_per["sample_id"].unique(), name="sample_id").sort_values()
+    rows = mag_ids.get_indexer(row_keys)
+    cols = sample_ids.get_indexer(reads_per["sample_id"])
+    values = reads_per["numreads"].to_numpy(dtype="float64", na_value=0.0)
+
+    reads = sparse.csc_matrix(
+        (values, (rows, cols)), shape=(len(mag_ids), len(sample_ids)), dtype="float64"
+    )
+    reads.eliminate_zeros()
+
+    # column-normalize: scale every sample by 1 / total reads (samples with no reads stay 0)
+    totals = np.asarray(reads.sum(axis=0)).ravel()
+    scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+    rel = sparse.csc_matrix(reads @ sparse.diags(scale))
+
+    logger.info(
+        f"Abundance matrix: {len(mag_ids)} MAGs × {len(sample_ids)} samples, "
+        f"{reads.nnz} non-zero entries."
+    )
+    return (
+        to_sparse_frame(reads, mag_ids, sample_ids),
+        to_sparse_frame(rel, mag_ids, sample_ids),
+    )
+
+
+def to_sparse_frame(matrix, index: pd.Index, columns: pd.Index) -> pd.DataFrame:
+    """Wraps a scipy sparse matrix in a DataFrame with SparseDtype columns (no densifying)."""
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+
+
+def save_sparse_matrix(df: pd.DataFrame, path: str | Path) -> None:
+    """
+    Saves a sparse MAG × sample DataFrame as a compressed .npz
+    (COO triplets + row and column ids), without densifying.
+    Row ids are stored one column per index level, so (sample_id, mag_id) rows round-trip.
+    """
+    coo = df.sparse.to_coo()
+    np.savez_compressed(
+        path,
+        data=coo.data,
+        row=coo.row,
+        col=coo.col,
+        shape=np.asarray(coo.shape),
+        index=np.asarray(df.index.to_frame(index=False), dtype=str),
+        columns=np.asarray(df.columns, dtype=str),
+        index_names=np.asarray([name or "" for name in df.index.names], dtype=str),
+        columns_name=np.asarray(df.columns.name or "", dtype=str),
+    )
+
+
+def load_sparse_matrix(path: str | Path) -> pd.DataFrame:
+    """Loads a matrix written by `save_sparse_matrix` back into a sparse DataFrame."""
+    with np.load(path, allow_pickle=False) as npz:
+        matrix = sparse.coo_matrix(
+            (npz["data"], (npz["row"], npz["col"])), shape=tuple(npz["shape"])
+        ).tocsc()
+        names = [str(name) or None for name in npz["index_names"]]
+        levels = [npz["index"][:, i] for i in range(len(names))]
+        if len(levels) == 1:
+            index = pd.Index(levels[0], name=names[0])
+        else:
+            index = pd.MultiIndex.from_arrays(levels, names=names)
+        columns = pd.Index(npz["columns"], name=str(npz["columns_name"]) or None)
+    return to_sparse_frame(matrix, index, columns)
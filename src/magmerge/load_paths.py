@@ -1,9 +1,24 @@
 import pandas as pd
 from loguru import logger
 
+# Arrow-backed dtypes: string columns are stored in Arrow buffers instead of Python objects,
+# pd.concat appends chunks instead of copying and .copy() shares the immutable buffers.
+STRING_DTYPE = "string[pyarrow]"
+
+
+def with_sample_id(df: pd.DataFrame, sample_id: str) -> pd.DataFrame:
+    """Prepends a constant `sample_id` column (Arrow string) to a per-sample frame."""
+    df.insert(0, "sample_id", pd.Series(sample_id, index=df.index, dtype=STRING_DTYPE))
+    return df
+
 
 def load_stage_files(
-    paths_csv: str, stage: str, build_paths_fn, reader_fn, print_paths: bool = True
+    paths_csv: str,
+    stage: str,
+    build_paths_fn,
+    reader_fn,
+    print_paths: bool = True,
+    add_sample_id: bool = False,
 ) -> pd.DataFrame:
     """
         Universal loader for files referenced in `python_paths.csv`.
@@ -13,6 +28,7 @@ def load_stage_files(
     :param build_paths_fn: function (row: pd.Series) -> List[Path]
     :param reader_fn: function (Path) -> pd.DataFrame (may return an empty DataFrame if the file is missing)
     :param print_paths: whether to print the file paths
+    :param add_sample_id: whether to prepend the row's sample_id as a column to each frame
     :return: concatenated DataFrame
 
     """
@@ -30,6 +46,8 @@ def load_stage_files(
                 print(path)
             try:
                 df_part = reader_fn(path)
+                if add_sample_id:
+                    df_part = with_sample_id(df_part, row["sample_id"])
                 frames.append(df_part)
             except FileNotFoundError:
                 logger.warning(f"File not found: {path}")
@@ -1,46 +1,234 @@
 import pandas as pd
 from loguru import logger
 
+from src.magmerge.load_paths import STRING_DTYPE
 from src.magmerge.taxonomy import split_taxonomy
 
+# Columns prepare_mag_table reads from each stage (BINNING = DASTool_summary.tsv);
+# pass them to the pipelines as `usecols` so the readers skip everything else.
+STAGE_COLUMNS = {
+    "BINNING": ["bin", "bin_score"],
+    "COVERAGE": ["rname", "endpos", "numreads", "sample_id"],
+    "GTDBTK": ["user_genome", "classification", "closest_genome_reference", "closest_genome_ani"],
+}
+
+
+def mag_table_columns(stage: str, extra: list[str] | None = None) -> list[str]:
+    """
+    Columns to load for `stage` (BINNING, COVERAGE, GTDBTK): the ones prepare_mag_table
+    needs plus any `extra` columns requested by the caller.
+    """
+    return list(dict.fromkeys(STAGE_COLUMNS[stage] + (extra or [])))
+
+
+RANKS = ["Domain", "Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+
+def coverage_frame(df_cov: pd.DataFrame) -> pd.DataFrame:
+    """Coverage projected to ['rname','endpos','numreads'(,'sample_id')] with numeric endpos/numreads."""
+    # sanity dtype; rename shares the column buffers (no copy for Arrow-backed frames)
+    # and only the columns used below are carried into the merge
+    cov = df_cov.rename(columns=lambda c: str(c).lstrip("#"))
+    cov_cols = ["rname", "endpos", "numreads"] + (["sample_id"] if "sample_id" in cov else [])
+    cov = cov[cov_cols]
+    cov["endpos"] = pd.to_numeric(cov["endpos"], errors="coerce", dtype_backend="pyarrow")
+    cov["numreads"] = pd.to_numeric(cov["numreads"], errors="coerce", dtype_backend="pyarrow")
+    return cov
+
+
+def contig2bin_frame(df_bin: pd.DataFrame) -> pd.DataFrame:
+    """contig->bin rows ['contig','bin'], led by 'sample_id' when df_bin carries it."""
+    cols = (["sample_id"] if "sample_id" in df_bin.columns else []) + ["contig", "bin"]
+    return df_bin[cols].dropna()
+
+
+def sample_keyed(cov: pd.DataFrame, contig2bin: pd.DataFrame) -> bool:
+    """
+    True when both coverage and contig2bin carry 'sample_id' (per-sample assemblies, as loaded
+    by the pipelines): contig and bin names such as 'k141_1' / 'metabat.1' repeat across
+    samples, so contigs and bins are only identified together with their sample.
+    Without 'sample_id' in contig2bin, df_bin is taken as a dereplicated catalog shared by
+    all samples and contigs are matched by name only.
+    """
+    return "sample_id" in cov.columns and "sample_id" in contig2bin.columns
+
+
+def join_coverage_bins(cov: pd.DataFrame, contig2bin: pd.DataFrame) -> pd.DataFrame:
+    """
+    Maps coverage rows (from coverage_frame) to bins (from contig2bin_frame): inner join on
+    (sample_id, rname == contig) when sample_keyed, otherwise on rname == contig.
+    Returns ['rname','endpos','numreads'(,'sample_id'),'contig','bin'].
+    """
+    if sample_keyed(cov, contig2bin):
+        return cov.merge(
+            contig2bin,
+            left_on=["sample_id", "rname"],
+            right_on=["sample_id", "contig"],
+            how="inner",
+        )
+    contig2bin = contig2bin.drop(columns=["sample_id"], errors="ignore")
+    return cov.merge(contig2bin, left_on="rname", right_on="contig", how="inner")
+
+
+def reject_bins(kept: pd.DataFrame, passing: pd.DataFrame, name: str) -> pd.DataFrame:
+    """
+    Keeps the bin keys of `kept` present in `passing` (matched on the key columns both carry)
+    and logs how many bins the filter `name` rejected.
+    """
+    on = [col for col in kept.columns if col in passing.columns]
+    survivors = kept.merge(passing[on].drop_duplicates(), on=on, how="inner")
+    logger.info(f"Rejected {len(kept) - len(survivors)} bins by {name}.")
+    return survivors
+
+
+def select_bins(
+    bins: pd.DataFrame,
+    bs: pd.DataFrame,
+    gtdb: pd.DataFrame,
+    min_bin_score: float | None = None,
+    min_ani: float | None = None,
+) -> tuple[pd.DataFrame | None, pd.DataFrame]:
+    """
+    Applies the numeric quality thresholds (bin_score, then ANI) to the bin keys
+    (['mag_id'] or ['sample_id','mag_id']); they only need the summary and the GTDB ANI
+    column, so they run before taxonomy parsing. Bins without a bin_score / ANI are rejected.
+    Returns (surviving bin keys or None when no threshold is set, GTDB rows passing min_ani).
+    """
+    if min_bin_score is None and min_ani is None:
+        return None, gtdb
+
+    kept = bins
+    if min_bin_score is not None:
+        mask = bs["bin_score"].ge(min_bin_score).to_numpy(dtype=bool, na_value=False)
+        kept = reject_bins(kept, bs.loc[mask], f"bin_score >= {min_bin_score}")
+    if min_ani is not None:
+        mask = gtdb["closest_reference_genome_ani"].ge(min_ani).to_numpy(dtype=bool, na_value=False)
+        # only the passing rows go on: a repeated user_genome may also have failing rows
+        gtdb = gtdb.loc[mask]
+        kept = reject_bins(kept, gtdb, f"closest_genome_ani >= {min_ani}")
+    return kept, gtdb
+
+
+def assigned_ranks(gtdb_clean: pd.DataFrame, required_ranks: list[str]) -> pd.DataFrame:
+    """GTDB rows with a name at every rank in `required_ranks`."""
+    # GTDB writes unassigned ranks as an empty name (e.g. 's__')
+    mask = gtdb_clean[required_ranks].fillna("").ne("").all(axis=1)
+    return gtdb_clean.loc[mask]
+
 
 def prepare_mag_table(
-    df_gtdb: pd.DataFrame, df_cov: pd.DataFrame, df_bin: pd.DataFrame
+    df_gtdb: pd.DataFrame,
+    df_cov: pd.DataFrame,
+    df_bin: pd.DataFrame,
+    df_bin_summary: pd.DataFrame | None = None,
+    min_bin_score: float | None = None,
+    min_ani: float | None = None,
+    required_ranks: list[str] | None = None,
 ) -> pd.DataFrame:
     """
     Builds the final MAG table as required.
     Expected inputs:
     - df_gtdb: columns at least ['user_genome','classification','closest_genome_reference','closest_genome_ani']
     - df_cov: columns at least ['rname','endpos','numreads'] (+ optional 'sample_id')
-    - df_bin: columns at least ['contig','bin'] + (from DASTool_summary.tsv) 'bin_score'
+    - df_bin: columns at least ['contig','bin'] (+ 'bin_score' if df_bin_summary is not given)
+    - df_bin_summary: optional per-bin DASTool_summary.tsv table with ['bin','bin_score'],
+      as returned next to contig2bin by pipeline_Binning
+    When df_cov and df_bin both carry 'sample_id' (pipeline outputs, per-sample assemblies)
+    a MAG is keyed by (sample_id, mag_id): contigs, bin_score, abundances and GTDB rows (when
+    df_gtdb carries 'sample_id') are matched within the sample and the output gets a leading
+    'sample_id' column. See sample_keyed.
+    Optional quality thresholds (applied before the coverage join, see select_bins):
+    - min_bin_score: minimal DAS Tool bin_score
+    - min_ani: minimal GTDB closest_genome_ani
+    - required_ranks: taxonomic ranks (e.g. ['Genus','Species']) that must be assigned
     Returns a DataFrame with columns:
     ['mag_id','genome_size','bin_score','relative_abundance',
     'Domain','Phylum','Class','Order','Family','Genus','Species', 'closest_reference_genome_id','closest_reference_genome_ani']
     and prints how many records were rejected due to missing values.
     """
+    cov = coverage_frame(df_cov)
+    contig2bin = contig2bin_frame(df_bin)
+    keyed = sample_keyed(cov, contig2bin)
+    bin_key = ["sample_id", "bin"] if keyed else ["bin"]
+    mag_key = ["sample_id", "mag_id"] if keyed else ["mag_id"]
+
+    # 1) bin_score from DASTool_summary
+    # Take unique bin_score per bin (repeated per contig when df_bin is a denormalized join).
+    bin_summary = df_bin if df_bin_summary is None else df_bin_summary
+    if "bin_score" in bin_summary.columns:
+        bs_key = [col for col in bin_key if col in bin_summary.columns]
+        bs = (
+            bin_summary[bs_key + ["bin_score"]].dropna(subset=bs_key).drop_duplicates(subset=bs_key)
+        )
+        bs["bin_score"] = pd.to_numeric(bs["bin_score"], errors="coerce", dtype_backend="pyarrow")
+        bs = bs.rename(columns={"bin": "mag_id"})
+    else:
+        # if no column in input
+        bs = pd.DataFrame(columns=["mag_id", "bin_score"])
 
-    # 1) map contig->bin and connect to coverage
-    # sanity dtype
-    cov = df_cov.copy()
-    cov.columns = [str(c).lstrip("#") for c in cov.columns]
-    cov["endpos"] = pd.to_numeric(cov["endpos"], errors="coerce")
-    cov["numreads"] = pd.to_numeric(cov["numreads"], errors="coerce")
+    # 2) GTDB: closest genome (taxonomy is parsed after the numeric filters)
+    # sample-keyed MAGs take the GTDB row of their own sample (user_genome repeats across samples)
+    gtdb_key = ["sample_id"] if keyed and "sample_id" in df_gtdb.columns else []
+    gtdb = df_gtdb[gtdb_key + STAGE_COLUMNS["GTDBTK"]].rename(
+        columns={
+            "user_genome": "mag_id",
+            "closest_genome_reference": "closest_reference_genome_id",
+            "closest_genome_ani": "closest_reference_genome_ani",
+        }
+    )
+    gtdb["closest_reference_genome_ani"] = pd.to_numeric(
+        gtdb["closest_reference_genome_ani"], errors="coerce", dtype_backend="pyarrow"
+    )
+
+    # 3) quality filters: the surviving bins are decided from the summary and GTDB first,
+    # so rejected bins are never split into ranks, joined to coverage or aggregated
+    if required_ranks:
+        unknown = set(required_ranks) - set(RANKS)
+        if unknown:
+            raise ValueError(f"Unknown taxonomic ranks: {sorted(unknown)}; expected {RANKS}.")
+    bins = contig2bin[bin_key].rename(columns={"bin": "mag_id"}).drop_duplicates()
+    if min_bin_score is not None or min_ani is not None or required_ranks:
+        logger.info(f"Quality filters: {len(bins)} bins before filtering.")
+    keep_bins, gtdb = select_bins(bins, bs, gtdb, min_bin_score, min_ani)
+    if keep_bins is not None:
+        on = [col for col in keep_bins.columns if col in gtdb.columns]
+        gtdb = gtdb.merge(keep_bins[on], on=on, how="inner")
+
+    # rank columns as Arrow strings, like the rest of the pipeline-loaded columns
+    tax = pd.DataFrame(
+        gtdb["classification"].map(split_taxonomy).tolist(), index=gtdb.index
+    ).astype(STRING_DTYPE)
 
-    contig2bin = df_bin[["contig", "bin"]].dropna().copy()
+    gtdb_clean = pd.concat([gtdb.drop(columns=["classification"]), tax], axis=1)
+    if required_ranks:
+        gtdb_clean = assigned_ranks(gtdb_clean, required_ranks)
+        keep_bins = reject_bins(
+            bins if keep_bins is None else keep_bins,
+            gtdb_clean,
+            f"required ranks {required_ranks}",
+        )
+    if keep_bins is not None:
+        logger.info(f"Quality filters: {len(keep_bins)} bins kept.")
 
-    cov_bin = cov.merge(contig2bin, left_on="rname", right_on="contig", how="inner")
+    # 4) map contig->bin and connect to coverage
+    # read totals come from the join over the unfiltered contig2bin, so relative abundance
+    # of the kept bins is the same as without filtering
+    binned = join_coverage_bins(cov, contig2bin)
+    cov_bin = binned
+    if keep_bins is not None and len(keep_bins) < len(bins):
+        cov_bin = binned.merge(keep_bins.rename(columns={"mag_id": "bin"}), on=bin_key, how="inner")
 
-    # 2) genome_size: sum of contig lengths in the bin
+    # 5) genome_size: sum of contig lengths in the bin
     # I take the contig length as endpos (coverage counted from 1 to endpos)
-    contig_len = cov_bin.groupby(["bin", "rname"], as_index=False)[
+    contig_len = cov_bin.groupby(bin_key + ["rname"], as_index=False)[
         "endpos"
     ].max()  # na wypadek duplikatów rname w pliku
     genome_size = (
-        contig_len.groupby("bin", as_index=False)["endpos"]
+        contig_len.groupby(bin_key, as_index=False)["endpos"]
         .sum()
         .rename(columns={"bin": "mag_id", "endpos": "genome_size"})
     )
-    # 3) relative abundance: share of readings per bin
+    # 6) relative abundance: share of readings per bin
     if "sample_id" in cov_bin.columns:
         reads_per = (
             cov_bin.groupby(["sample_id", "bin"], as_index=False)["numreads"]
@@ -48,78 +236,42 @@ def prepare_mag_table(
             .rename(columns={"numreads": "reads_in_bin"})
         )
         total_reads = (
-            cov_bin.groupby("sample_id", as_index=False)["numreads"]
+            binned.groupby("sample_id", as_index=False)["numreads"]
             .sum()
             .rename(columns={"numreads": "reads_total"})
         )
         rel = reads_per.merge(total_reads, on="sample_id", how="left")
         rel["relative_abundance"] = rel["reads_in_bin"] / rel["reads_total"]
-        rel = rel.rename(columns={"bin": "mag_id"})[["mag_id", "relative_abundance"]]
+        rel = rel.rename(columns={"bin": "mag_id"})[["sample_id", "mag_id", "relative_abundance"]]
         # If I have multiple samples, duplicate mag_ids from different samples may result.
         # Consolidate by sum (or average). By default, I'll take the sum of the contributions (typically 1 sample => no influence).
-        rel = rel.groupby("mag_id", as_index=False)["relative_abundance"].sum()
+        # Sample-keyed MAGs are already unique per (sample_id, mag_id), nothing is summed.
+        rel = rel.groupby(mag_key, as_index=False)["relative_abundance"].sum()
     else:
         reads_per = (
             cov_bin.groupby("bin", as_index=False)["numreads"]
             .sum()
             .rename(columns={"numreads": "reads_in_bin"})
         )
-        total_reads = reads_per["reads_in_bin"].sum()
+        total_reads = binned["numreads"].sum()
         rel = reads_per.assign(relative_abundance=reads_per["reads_in_bin"] / total_reads)
         rel = rel.rename(columns={"bin": "mag_id"})[["mag_id", "relative_abundance"]]
 
-    # 4) bin_score from DASTool_summary
-    # Take unique bin_score per bin (sometimes repeated per contig).
-    if "bin_score" in df_bin.columns:
-        bs = df_bin[["bin", "bin_score"]].dropna(subset=["bin"]).drop_duplicates(subset=["bin"])
-        bs["bin_score"] = pd.to_numeric(bs["bin_score"], errors="coerce")
-        bs = bs.rename(columns={"bin": "mag_id"})
-    else:
-        # if no column in input
-        bs = pd.DataFrame(columns=["mag_id", "bin_score"])
-
-    # 5) GTDB: taxonomy + closest genome
-    gtdb = df_gtdb[
-        ["user_genome", "classification", "closest_genome_reference", "closest_genome_ani"]
-    ].copy()
-
-    print(gtdb["classification"])
-
-    tax = gtdb["classification"].apply(split_taxonomy).apply(pd.Series)
-    print(tax)
-
-    gtdb_clean = pd.concat([gtdb.drop(columns=["classification"]), tax], axis=1)
-    gtdb_clean = gtdb_clean.rename(
-        columns={
-            "user_genome": "mag_id",
-            "closest_genome_reference": "closest_reference_genome_id",
-            "closest_genome_ani": "closest_reference_genome_ani",
-        }
-    )
-    gtdb_clean["closest_reference_genome_ani"] = pd.to_numeric(
-        gtdb_clean["closest_reference_genome_ani"], errors="coerce"
-    )
-
-    # 6) Merging everything by mag_id
+    # 7) Merging everything by mag_id (+ sample_id where both sides carry it)
     merged = (
-        genome_size.merge(rel, on="mag_id", how="left")
-        .merge(bs, on="mag_id", how="left")
-        .merge(gtdb_clean, on="mag_id", how="left")
+        genome_size.merge(rel, on=mag_key, how="left")
+        .merge(bs, on=[col for col in mag_key if col in bs.columns], how="left")
+        .merge(gtdb_clean, on=[col for col in mag_key if col in gtdb_clean.columns], how="left")
     )
 
-    # 7) First select only the required columns
-    wanted = [
+    # 8) First select only the required columns
+    wanted = ["sample_id"] if keyed else []
+    wanted += [
         "mag_id",
         "genome_size",
         "bin_score",
         "relative_abundance",
-        "Domain",
-        "Phylum",
-        "Class",
-        "Order",
-        "Family",
-        "Genus",
-        "Species",
+        *RANKS,
         "closest_reference_genome_id",
         "closest_reference_genome_ani",
     ]
@@ -1,42 +1,92 @@
+from collections import defaultdict
 from pathlib import Path
 import pandas as pd
 from loguru import logger
 
-from src.magmerge.load_paths import load_stage_files
+from src.magmerge.load_paths import STRING_DTYPE, load_stage_files, with_sample_id
+
+# samtools coverage columns with a known type; anything else is read as string
+COVERAGE_DTYPES = {
+    "#rname": STRING_DTYPE,
+    "rname": STRING_DTYPE,
+    "startpos": "int64[pyarrow]",
+    "endpos": "int64[pyarrow]",
+    "numreads": "int64[pyarrow]",
+    "covbases": "int64[pyarrow]",
+    "coverage": "double[pyarrow]",
+    "meandepth": "double[pyarrow]",
+    "meanbaseq": "double[pyarrow]",
+    "meanmapq": "double[pyarrow]",
+}
+
+# DASTool_summary.tsv columns with a known type
+BIN_SUMMARY_DTYPES = {
+    "bin": STRING_DTYPE,
+    "bin_set": STRING_DTYPE,
+    "unique_SCGs": "int64[pyarrow]",
+    "redundant_SCGs": "int64[pyarrow]",
+    "SCG_set_size": "int64[pyarrow]",
+    "size": "int64[pyarrow]",
+    "contigs": "int64[pyarrow]",
+    "N50": "int64[pyarrow]",
+    "bin_score": "double[pyarrow]",
+    "SCG_completeness": "double[pyarrow]",
+    "SCG_redundancy": "double[pyarrow]",
+}
+
+# gtdbtk.bac120.summary.tsv numeric columns used downstream ("N/A" is parsed as missing)
+GTDB_DTYPES = {
+    "closest_genome_ani": "double[pyarrow]",
+    "closest_genome_af": "double[pyarrow]",
+    "msa_percent": "double[pyarrow]",
+}
+
+
+def typed(dtypes: dict[str, str]) -> defaultdict:
+    """read_csv dtype mapping: known columns typed, all other columns as Arrow strings."""
+    return defaultdict(lambda: STRING_DTYPE, dtypes)
+
+
+def column_filter(usecols: list[str] | None, key: str):
+    """
+    read_csv `usecols` callable keeping the requested columns plus the stage key column.
+    A leading '#' in the header (samtools coverage) is ignored; requested columns missing
+    from a file are skipped. None keeps every column.
+    """
+    if usecols is None:
+        return None
+    wanted = {key, *usecols}
+    return lambda col: col.lstrip("#") in wanted
+
+
+def empty_frame(columns: list[str]) -> pd.DataFrame:
+    """Empty DataFrame with Arrow string columns (keeps dtypes stable across pd.concat)."""
+    return pd.DataFrame({col: pd.Series(dtype=STRING_DTYPE) for col in columns})
 
 
 # PIPELINE: BINNING
-def pipeline_Binning(paths_csv: str, print_paths: bool = True) -> pd.DataFrame:
-    def build_paths(row):
-        folder = Path(row["folder"])
-        sample_id = row["sample_id"]
-        return [
-            folder / f"{sample_id}_DASTool_contig2bin.tsv",
-            folder / f"{sample_id}_DASTool_summary.tsv",
-        ]
+def pipeline_Binning(
+    paths_csv: str, print_paths: bool = True, usecols: list[str] | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads DAS Tool outputs as a normalized pair instead of a per-contig join.
 
-    def reader(path: Path) -> pd.DataFrame:
-        if path.name.endswith("contig2bin.tsv"):
-            return pd.read_csv(
-                path,
-                sep="\t",
-                header=None,
-                names=["contig", "bin"],
-                dtype={"contig": "string", "bin": "string"},
-            )
-        elif path.name.endswith("summary.tsv"):
-            return pd.read_csv(path, sep="\t", dtype="string")
-        else:
-            return pd.DataFrame()
+    :param usecols: DASTool_summary.tsv columns to parse ('bin' is always kept); None = all
+
+    :return: (contig2bin, bin_summary)
+        - contig2bin: columns ['sample_id','contig','bin']
+        - bin_summary: one row per (sample_id, bin) with the DASTool_summary.tsv columns
+    """
 
-    # special contig2bin join with summary → outer join after bin
+    # contig2bin and summary are kept apart: the summary is per bin, not per contig
     df_paths = pd.read_csv(
         paths_csv,
         sep=",",
         dtype=str,
     )
     bin_rows = df_paths[df_paths["stage"] == "BINNING"].copy()
-    frames: list[pd.DataFrame] = []
+    c2b_frames: list[pd.DataFrame] = []
+    summary_frames: list[pd.DataFrame] = []
 
     for _, row in bin_rows.iterrows():
         folder = Path(row["folder"])
@@ -50,51 +100,85 @@ def pipeline_Binning(paths_csv: str, print_paths: bool = True) -> pd.DataFrame:
 
         try:
             c2b = pd.read_csv(
-                contig2bin_path, sep="\t", header=None, names=["contig", "bin"], dtype="string"
+                contig2bin_path, sep="\t", header=None, names=["contig", "bin"], dtype=STRING_DTYPE
             )
+            c2b_frames.append(with_sample_id(c2b, sample_id))
         except FileNotFoundError:
             logger.warning(f"File not found: {contig2bin_path}")
-            c2b = pd.DataFrame(columns=["contig", "bin"])
 
         try:
-            summ = pd.read_csv(summary_path, sep="\t", dtype="string")
-            if "bin" not in summ.columns:
-                summ = pd.DataFrame(columns=["bin"])
+            summ = pd.read_csv(
+                summary_path,
+                sep="\t",
+                usecols=column_filter(usecols, "bin"),
+                dtype=typed(BIN_SUMMARY_DTYPES),
+            )
+            if "bin" in summ.columns:
+                summary_frames.append(with_sample_id(summ, sample_id))
         except FileNotFoundError:
             logger.warning(f"File not found: {summary_path}")
-            summ = pd.DataFrame(columns=["bin"])
 
-        merged = c2b.merge(summ, on="bin", how="outer")
-        frames.append(merged)
-
-    if not frames:
-        return pd.DataFrame(columns=["contig", "bin"])
-
-    return pd.concat(frames, ignore_index=True)
+    df_c2b = (
+        pd.concat(c2b_frames, ignore_index=True)
+        if c2b_frames
+        else empty_frame(["sample_id", "contig", "bin"])
+    )
+    df_summary = (
+        pd.concat(summary_frames, ignore_index=True)
+        if summary_frames
+        else empty_frame(["sample_id", "bin"])
+    )
+    return df_c2b, df_summary
 
 
 # PIPELINE: COVERAGE
-def pipeline_COVERAGE(paths_csv: str, print_paths: bool = True) -> pd.DataFrame:
+def pipeline_COVERAGE(
+    paths_csv: str, print_paths: bool = True, usecols: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    :param usecols: samtools coverage columns to parse ('rname' is always kept); None = all
+    """
+
     def build_paths(row):
         folder = Path(row["folder"])
         sample_id = row["sample_id"]
         return [folder / f"{sample_id}_coverage.tsv"]
 
     def reader(path: Path) -> pd.DataFrame:
-        df = pd.read_csv(path, sep="\t", dtype="string")
+        df = pd.read_csv(
+            path,
+            sep="\t",
+            usecols=column_filter(usecols, "rname"),
+            dtype=typed(COVERAGE_DTYPES),
+        )
         df.columns = [col.lstrip("#") for col in df.columns]
         return df
 
-    return load_stage_files(paths_csv, "COVERAGE", build_paths, reader, print_paths)
+    return load_stage_files(
+        paths_csv, "COVERAGE", build_paths, reader, print_paths, add_sample_id=True
+    )
 
 
 # PIPELINE: GTDBTK
-def pipeline_GTDBTK(paths_csv: str, print_paths: bool = True) -> pd.DataFrame:
+def pipeline_GTDBTK(
+    paths_csv: str, print_paths: bool = True, usecols: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    :param usecols: GTDB-Tk summary columns to parse ('user_genome' is always kept); None = all
+    """
+
     def build_paths(row):
         folder = Path(row["folder"])
         return [folder / "gtdbtk.bac120.summary.tsv"]
 
     def reader(path: Path) -> pd.DataFrame:
-        return pd.read_csv(path, sep="\t", dtype="string")
-
-    return load_stage_files(paths_csv, "GTDBTK", build_paths, reader, print_paths)
+        return pd.read_csv(
+            path,
+            sep="\t",
+            usecols=column_filter(usecols, "user_genome"),
+            dtype=typed(GTDB_DTYPES),
+        )
+
+    return load_stage_files(
+        paths_csv, "GTDBTK", build_paths, reader, print_paths, add_sample_id=True
+    )
@@ -0,0 +1,110 @@
+import pandas as pd
+import pytest
+
+import magmerge.pipelines as pl
+from magmerge.abundance import load_sparse_matrix, prepare_abundance_matrix, save_sparse_matrix
+
+
+def make_inputs():
+    df_cov = pd.DataFrame(
+        {
+            "rname": ["c1", "c2", "c3", "c1", "c3"],
+            "endpos": [100, 200, 300, 100, 300],
+            "numreads": [10, 30, 60, 5, 0],
+            "sample_id": ["S1", "S1", "S1", "S2", "S2"],
+        }
+    )
+    df_bin = pd.DataFrame({"contig": ["c1", "c2", "c3"], "bin": ["bin1", "bin1", "bin2"]})
+    return df_cov, df_bin
+
+
+def test_reads_and_relative_abundance_per_sample():
+    df_cov, df_bin = make_inputs()
+
+    reads, rel = prepare_abundance_matrix(df_cov, df_bin)
+
+    assert list(reads.index) == ["bin1", "bin2"]
+    assert list(reads.columns) == ["S1", "S2"]
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in reads.dtypes)
+    assert reads.loc["bin1", "S1"] == 40
+    assert reads.loc["bin2", "S2"] == 0
+    # zero counts are not stored
+    assert reads.sparse.density == pytest.approx(3 / 4)
+    assert rel.loc["bin1", "S1"] == pytest.approx(0.4)
+    assert rel.loc["bin1", "S2"] == pytest.approx(1.0)
+    assert rel.sum().tolist() == pytest.approx([1.0, 1.0])
+
+
+def test_missing_sample_id_raises():
+    df_cov, df_bin = make_inputs()
+    with pytest.raises(ValueError):
+        prepare_abundance_matrix(df_cov.drop(columns=["sample_id"]), df_bin)
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    df_cov, df_bin = make_inputs()
+    reads, _ = prepare_abundance_matrix(df_cov, df_bin)
+
+    path = tmp_path / "reads.npz"
+    save_sparse_matrix(reads, path)
+    loaded = load_sparse_matrix(path)
+
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in loaded.dtypes)
+    assert loaded.index.name == "mag_id"
+    assert loaded.columns.name == "sample_id"
+    pd.testing.assert_frame_equal(
+        loaded.sparse.to_dense(),
+        reads.sparse.to_dense(),
+        check_index_type=False,
+        check_column_type=False,
+    )
+
+
+def load_colliding_samples(tmp_path):
+    # two per-sample assemblies reusing the same contig and bin names
+    rows = []
+    for sample_id, reads in [("S1", 10), ("S2", 20)]:
+        folder = tmp_path / sample_id
+        folder.mkdir()
+        (folder / f"{sample_id}_DASTool_contig2bin.tsv").write_text("k141_1\tmetabat.1\n")
+        (folder / f"{sample_id}_coverage.tsv").write_text(
+            f"#rname\tstartpos\tendpos\tnumreads\nk141_1\t1\t1000\t{reads}\n"
+        )
+        for stage in ["BINNING", "COVERAGE"]:
+            rows.append(
+                {"study_id": "st", "sample_id": sample_id, "stage": stage, "folder": str(folder)}
+            )
+    paths_csv = tmp_path / "python_paths.csv"
+    pd.DataFrame(rows).to_csv(paths_csv, index=False)
+
+    df_bin, _ = pl.pipeline_Binning(str(paths_csv), print_paths=False)
+    df_cov = pl.pipeline_COVERAGE(str(paths_csv), print_paths=False)
+    return df_cov, df_bin
+
+
+def test_colliding_names_are_matched_within_their_sample(tmp_path):
+    df_cov, df_bin = load_colliding_samples(tmp_path)
+
+    reads, rel = prepare_abundance_matrix(df_cov, df_bin)
+
+    assert list(reads.index) == [("S1", "metabat.1"), ("S2", "metabat.1")]
+    assert reads.index.names == ["sample_id", "mag_id"]
+    assert reads.loc[("S1", "metabat.1"), "S1"] == 10
+    assert reads.loc[("S2", "metabat.1"), "S2"] == 20
+    # no cross-sample pairs
+    assert reads.loc[("S1", "metabat.1"), "S2"] == 0
+    assert reads.sparse.to_coo().nnz == 2
+    assert rel.sum().tolist() == pytest.approx([1.0, 1.0])
+
+
+def test_save_and_load_roundtrip_sample_keyed(tmp_path):
+    df_cov, df_bin = load_colliding_samples(tmp_path)
+    reads, _ = prepare_abundance_matrix(df_cov, df_bin)
+
+    path = tmp_path / "reads.npz"
+    save_sparse_matrix(reads, path)
+    loaded = load_sparse_matrix(path)
+
+    assert list(loaded.index) == list(reads.index)
+    assert loaded.index.names == ["sample_id", "mag_id"]
+    assert loaded.loc[("S2", "metabat.1"), "S2"] == 20
@@ -178,3 +178,33 @@ def test_print_paths_false_suppresses_stdout(tmp_path, capsys):
 
     captured = capsys.readouterr()
     assert captured.out == ""
+
+
+def test_add_sample_id_takes_sample_from_paths_row(tmp_path):
+    paths_csv = write_paths_csv(
+        tmp_path,
+        [
+            {"study_id": "S1", "sample_id": "A", "stage": "COVERAGE", "folder": "shared"},
+            {"study_id": "S1", "sample_id": "B", "stage": "COVERAGE", "folder": "shared"},
+        ],
+    )
+
+    # both rows point at the same file name: the sample cannot come from the path
+    def build_paths_fn(row: pd.Series):
+        return [tmp_path / row["folder"] / "coverage.tsv"]
+
+    def reader_fn(p: Path):
+        return pd.DataFrame({"rname": ["c1"]})
+
+    out = load_stage_files(
+        paths_csv=str(paths_csv),
+        stage="COVERAGE",
+        build_paths_fn=build_paths_fn,
+        reader_fn=reader_fn,
+        print_paths=False,
+        add_sample_id=True,
+    )
+
+    assert list(out.columns) == ["sample_id", "rname"]
+    assert out["sample_id"].tolist() == ["A", "B"]
+    assert out["sample_id"].dtype == "string[pyarrow]"
@@ -3,7 +3,7 @@ import pytest
 
 from loguru import logger
 
-from magmerge.merge_mag import prepare_mag_table
+from magmerge.merge_mag import mag_table_columns, prepare_mag_table
 
 
 def make_inputs_with_sampleid():
@@ -103,3 +103,241 @@ def test_empty_inputs_returns_empty_df():
     # prepare_mag_table na kompletnie pustych danych nie ma jak stworzyć wszystkich kolumn → KeyError
     with pytest.raises(KeyError):
         _ = prepare_mag_table(df_gtdb, df_cov, df_bin)
+
+
+def test_arrow_backed_inputs():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    df_gtdb = df_gtdb.astype("string[pyarrow]")
+    df_cov = df_cov.astype(
+        {"rname": "string[pyarrow]", "sample_id": "string[pyarrow]", "numreads": "int64[pyarrow]"}
+    )
+    df_bin = df_bin.astype("string[pyarrow]")
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin)
+
+    assert set(out["mag_id"]) == {"bin1", "bin2"}
+    assert out.loc[out["mag_id"] == "bin1", "genome_size"].iloc[0] == 300
+    assert out["relative_abundance"].sum() == pytest.approx(1.0)
+
+
+def test_normalized_bin_summary():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    df_bin_summary = pd.DataFrame(
+        {"sample_id": ["S1", "S1"], "bin": ["bin1", "bin2"], "bin_score": ["0.5", "0.8"]}
+    )
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin[["contig", "bin"]], df_bin_summary)
+
+    assert set(out["mag_id"]) == {"bin1", "bin2"}
+    assert out.loc[out["mag_id"] == "bin2", "bin_score"].iloc[0] == pytest.approx(0.8)
+
+
+def test_mag_table_columns_with_extra():
+    cols = mag_table_columns("GTDBTK", extra=["red_value", "user_genome"])
+    assert cols[:4] == [
+        "user_genome",
+        "classification",
+        "closest_genome_reference",
+        "closest_genome_ani",
+    ]
+    assert cols[4:] == ["red_value"]
+
+
+def test_quality_filters_reject_bins_before_join():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    baseline = prepare_mag_table(df_gtdb, df_cov, df_bin)
+
+    messages = []
+    sink = logger.add(lambda m: messages.append(m), level="INFO")
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, min_bin_score=60, min_ani=90)
+
+    logger.remove(sink)
+
+    # bin1 has bin_score 50 → rejected; bin2 keeps the unfiltered relative abundance
+    assert set(out["mag_id"]) == {"bin2"}
+    expected = baseline.loc[baseline["mag_id"] == "bin2", "relative_abundance"].iloc[0]
+    assert out["relative_abundance"].iloc[0] == pytest.approx(expected)
+    combined = "\n".join(m.record["message"] for m in messages)
+    assert "Rejected 1 bins by bin_score >= 60" in combined
+    assert "Rejected 0 bins by closest_genome_ani >= 90" in combined
+
+
+def test_required_ranks_rejects_unassigned_species():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    df_gtdb.loc[df_gtdb["user_genome"] == "bin2", "classification"] = (
+        "d__Bacteria;p__Proteobacteria;c__Gammaproteo;o__Enterobacterales;"
+        "f__Enterobacteriaceae;g__Escherichia;s__"
+    )
+
+    assert set(prepare_mag_table(df_gtdb, df_cov, df_bin)["mag_id"]) == {"bin1", "bin2"}
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, required_ranks=["Genus", "Species"])
+    assert set(out["mag_id"]) == {"bin1"}
+
+    with pytest.raises(ValueError):
+        prepare_mag_table(df_gtdb, df_cov, df_bin, required_ranks=["Strain"])
+
+
+def test_output_columns_are_arrow_backed():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin)
+
+    assert all(out[rank].dtype == "string[pyarrow]" for rank in ["Domain", "Genus", "Species"])
+    assert out["closest_reference_genome_ani"].dtype == "double[pyarrow]"
+    assert out["relative_abundance"].dtype == "double[pyarrow]"
+
+
+def make_sample_keyed_inputs():
+    # pipeline_Binning / pipeline_COVERAGE shaped: per-sample assemblies reuse names
+    df_cov = pd.DataFrame(
+        {
+            "sample_id": ["S1", "S2"],
+            "rname": ["k141_1", "k141_1"],
+            "endpos": [1000, 2000],
+            "numreads": [10, 20],
+        }
+    )
+    df_bin = pd.DataFrame(
+        {"sample_id": ["S1", "S2"], "contig": ["k141_1", "k141_1"], "bin": ["metabat.1"] * 2}
+    )
+    df_bin_summary = pd.DataFrame(
+        {"sample_id": ["S1", "S2"], "bin": ["metabat.1"] * 2, "bin_score": [0.9, 0.1]}
+    )
+    # one GTDB-Tk run per sample, as loaded by pipeline_GTDBTK
+    df_gtdb = pd.DataFrame(
+        {
+            "sample_id": ["S1", "S2"],
+            "user_genome": ["metabat.1"] * 2,
+            "classification": [
+                "d__Bacteria;p__P1;c__C1;o__O1;f__F1;g__G1;s__S1",
+                "d__Archaea;p__P2;c__C2;o__O2;f__F2;g__G2;s__S2",
+            ],
+            "closest_genome_reference": ["ref1", "ref2"],
+            "closest_genome_ani": ["97.0", "80.0"],
+        }
+    )
+    return df_gtdb, df_cov, df_bin, df_bin_summary
+
+
+def test_sample_keyed_bins_are_not_mixed_across_samples():
+    df_gtdb, df_cov, df_bin, df_bin_summary = make_sample_keyed_inputs()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, df_bin_summary).set_index("sample_id")
+
+    assert list(out.index) == ["S1", "S2"]
+    assert (out["mag_id"] == "metabat.1").all()
+    assert out.loc["S1", "bin_score"] == pytest.approx(0.9)
+    assert out.loc["S2", "bin_score"] == pytest.approx(0.1)
+    assert out.loc["S2", "genome_size"] == 2000
+    assert out["relative_abundance"].tolist() == pytest.approx([1.0, 1.0])
+    # each sample's MAG gets its own GTDB row (no cross-sample rows)
+    assert out.loc["S1", "Genus"] == "G1"
+    assert out.loc["S2", "Domain"] == "Archaea"
+    assert out.loc["S2", "closest_reference_genome_id"] == "ref2"
+
+
+def test_sample_keyed_bin_score_filter():
+    df_gtdb, df_cov, df_bin, df_bin_summary = make_sample_keyed_inputs()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, df_bin_summary, min_bin_score=0.5)
+
+    assert out["sample_id"].tolist() == ["S1"]
+
+
+def test_sample_keyed_ani_filter():
+    df_gtdb, df_cov, df_bin, df_bin_summary = make_sample_keyed_inputs()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, df_bin_summary, min_ani=95)
+
+    # only S1's metabat.1 has ANI >= 95
+    assert out["sample_id"].tolist() == ["S1"]
+    assert out["closest_reference_genome_ani"].tolist() == [97.0]
+
+
+def test_filter_rejecting_nothing_leaves_output_identical():
+    df_gtdb, df_cov, _ = make_inputs_with_sampleid()
+    # c1 is listed in both bins (denormalized contig2bin)
+    df_bin = pd.DataFrame(
+        {
+            "contig": ["c1", "c1", "c2", "c3"],
+            "bin": ["bin1", "bin2", "bin1", "bin2"],
+            "bin_score": [50, 80, 50, 80],
+        }
+    )
+
+    baseline = prepare_mag_table(df_gtdb, df_cov, df_bin)
+    filtered = prepare_mag_table(df_gtdb, df_cov, df_bin, min_bin_score=0, min_ani=0)
+
+    pd.testing.assert_frame_equal(filtered, baseline)
+
+
+def test_taxonomy_is_parsed_only_for_bins_passing_numeric_filters(monkeypatch):
+    import magmerge.merge_mag as mm
+
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    parsed = []
+    original = mm.split_taxonomy
+
+    def spy(classif):
+        parsed.append(classif)
+        return original(classif)
+
+    monkeypatch.setattr(mm, "split_taxonomy", spy)
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, min_ani=99, required_ranks=["Species"])
+
+    assert set(out["mag_id"]) == {"bin2"}
+    # bin1 (ANI 95.5) was rejected before its classification was split
+    assert len(parsed) == 1
+    assert "Escherichia" in parsed[0]
+
+
+def test_filters_drop_failing_rows_of_repeated_user_genome():
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    full = "d__Bacteria;p__P;c__C;o__O;f__F;g__G;s__S"
+    # every bin has a failing and a passing GTDB row
+    df_gtdb = pd.DataFrame(
+        {
+            "user_genome": ["bin1", "bin1", "bin2", "bin2"],
+            "classification": [
+                full.replace("s__S", "s__"),
+                full,
+                full,
+                full.replace("s__S", "s__"),
+            ],
+            "closest_genome_reference": ["r1a", "r1b", "r2a", "r2b"],
+            "closest_genome_ani": ["70.0", "97.0", "80.0", "99.0"],
+        }
+    )
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, min_ani=95)
+    assert set(out["mag_id"]) == {"bin1", "bin2"}
+    assert (out["closest_reference_genome_ani"] >= 95).all()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, required_ranks=["Species"])
+    assert set(out["closest_reference_genome_id"]) == {"r1b", "r2a"}
+    assert (out["Species"] != "").all()
+
+    out = prepare_mag_table(df_gtdb, df_cov, df_bin, min_ani=95, required_ranks=["Species"])
+    assert out["closest_reference_genome_id"].tolist() == ["r1b"]
+
+
+def test_coverage_joined_once_with_or_without_filters(monkeypatch):
+    import magmerge.merge_mag as mm
+
+    df_gtdb, df_cov, df_bin = make_inputs_with_sampleid()
+    calls = []
+    original = mm.join_coverage_bins
+
+    def spy(cov, contig2bin):
+        calls.append(len(contig2bin))
+        return original(cov, contig2bin)
+
+    monkeypatch.setattr(mm, "join_coverage_bins", spy)
+
+    prepare_mag_table(df_gtdb, df_cov, df_bin)
+    prepare_mag_table(df_gtdb, df_cov, df_bin, min_bin_score=0)
+    prepare_mag_table(df_gtdb, df_cov, df_bin, min_bin_score=60)
+    # always the unfiltered contig2bin: rejected bins are dropped from the joined frame
+    assert calls == [3, 3, 3]
@@ -25,13 +25,16 @@ def test_pipeline_binning_merges_contig2bin_and_summary(tmp_path):
         [{"study_id": "st1", "sample_id": "S1", "stage": "BINNING", "folder": str(folder)}],
     )
 
-    df = pl.pipeline_Binning(str(paths_csv), print_paths=False)
-
-    # two contigs with matching summary info
-    assert set(df.columns) >= {"contig", "bin", "score"}
-    assert len(df) == 2
-    row = df[df["contig"] == "contigA"].iloc[0]
-    assert row["bin"] == "bin1"
+    c2b, summary = pl.pipeline_Binning(str(paths_csv), print_paths=False)
+
+    # contig->bin map and per-bin summary are returned separately
+    assert list(c2b.columns) == ["sample_id", "contig", "bin"]
+    assert len(c2b) == 2
+    assert c2b.loc[c2b["contig"] == "contigA", "bin"].iloc[0] == "bin1"
+    assert set(summary.columns) >= {"sample_id", "bin", "score"}
+    assert len(summary) == 2
+    row = summary[summary["bin"] == "bin1"].iloc[0]
+    assert row["sample_id"] == "S1"
     assert row["score"] == "100"
 
 
@@ -50,12 +53,13 @@ def test_pipeline_binning_missing_files_logs_warning(tmp_path):
     messages = []
     sink_id = logger.add(lambda m: messages.append(m), level="WARNING")
 
-    df = pl.pipeline_Binning(str(paths_csv), print_paths=False)
+    c2b, summary = pl.pipeline_Binning(str(paths_csv), print_paths=False)
 
     logger.remove(sink_id)
 
-    # contig2bin loaded, summary missing → still returns DF
-    assert "contigX" in df["contig"].tolist()
+    # contig2bin loaded, summary missing → still returns both frames
+    assert "contigX" in c2b["contig"].tolist()
+    assert summary.empty
 
     # warning should be logged
     all_msgs = "".join(m.record["message"] for m in messages)
@@ -66,8 +70,9 @@ def test_pipeline_binning_empty_when_no_rows(tmp_path):
     paths_csv = write_paths_csv(
         tmp_path, [{"study_id": "st3", "sample_id": "S3", "stage": "COVERAGE", "folder": "x"}]
     )
-    df = pl.pipeline_Binning(str(paths_csv), print_paths=False)
-    assert df.empty
+    c2b, summary = pl.pipeline_Binning(str(paths_csv), print_paths=False)
+    assert c2b.empty
+    assert summary.empty
 
 
 def test_pipeline_coverage_reads_and_strips_hash(tmp_path):
@@ -86,6 +91,8 @@ def test_pipeline_coverage_reads_and_strips_hash(tmp_path):
     assert "reads" in df.columns
     assert df.loc[0, "rname"] == "contigA"
     assert df.loc[0, "reads"] == "10"
+    # sample_id taken from the file name
+    assert df.loc[0, "sample_id"] == "S4"
 
 
 def test_pipeline_gtdbtk_reads_summary(tmp_path):
@@ -102,5 +109,65 @@ def test_pipeline_gtdbtk_reads_summary(tmp_path):
 
     assert "user_genome" in df.columns
     assert "taxonomy" in df.columns
+    assert df.iloc[0]["sample_id"] == "S5"
     assert df.iloc[0]["user_genome"] == "MAG1"
     assert "Bacteria" in df.iloc[0]["taxonomy"]
+
+
+def test_pipeline_coverage_uses_arrow_dtypes(tmp_path):
+    folder = tmp_path / "s6"
+    folder.mkdir()
+    (folder / "S6_coverage.tsv").write_text(
+        "#rname\tstartpos\tendpos\tnumreads\tmeandepth\ncontigA\t1\t500\t42\t3.5\n"
+    )
+    paths_csv = write_paths_csv(
+        tmp_path,
+        [{"study_id": "st6", "sample_id": "S6", "stage": "COVERAGE", "folder": str(folder)}],
+    )
+
+    df = pl.pipeline_COVERAGE(str(paths_csv), print_paths=False)
+
+    assert df["rname"].dtype == "string[pyarrow]"
+    assert df["endpos"].dtype == "int64[pyarrow]"
+    assert df["meandepth"].dtype == "double[pyarrow]"
+    assert df.loc[0, "numreads"] == 42
+
+
+def test_pipelines_usecols_skip_unrequested_columns(tmp_path):
+    folder = tmp_path / "s7"
+    folder.mkdir()
+    (folder / "S7_coverage.tsv").write_text(
+        "#rname\tstartpos\tendpos\tnumreads\tmeandepth\ncontigA\t1\t500\t42\t3.5\n"
+    )
+    (folder / "S7_DASTool_contig2bin.tsv").write_text("contigA\tbin1\n")
+    (folder / "S7_DASTool_summary.tsv").write_text(
+        "bin\tbin_set\tsize\tbin_score\nbin1\tmetabat\t500\t0.75\n"
+    )
+    (folder / "gtdbtk.bac120.summary.tsv").write_text(
+        "user_genome\tclassification\tclosest_genome_ani\tred_value\nbin1\td__Bacteria\tN/A\t0.9\n"
+    )
+    paths_csv = write_paths_csv(
+        tmp_path,
+        [
+            {"study_id": "st7", "sample_id": "S7", "stage": stage, "folder": str(folder)}
+            for stage in ["BINNING", "COVERAGE", "GTDBTK"]
+        ],
+    )
+
+    cov = pl.pipeline_COVERAGE(str(paths_csv), print_paths=False, usecols=["endpos", "numreads"])
+    _, summary = pl.pipeline_Binning(str(paths_csv), print_paths=False, usecols=["bin_score"])
+    gtdb = pl.pipeline_GTDBTK(
+        str(paths_csv), print_paths=False, usecols=["classification", "closest_genome_ani"]
+    )
+
+    # key columns are always kept, typed columns are parsed
+    assert list(cov.columns) == ["sample_id", "rname", "endpos", "numreads"]
+    assert list(summary.columns) == ["sample_id", "bin", "bin_score"]
+    assert summary.loc[0, "bin_score"] == 0.75
+    assert list(gtdb.columns) == [
+        "sample_id",
+        "user_genome",
+        "classification",
+        "closest_genome_ani",
+    ]
+    assert gtdb["closest_genome_ani"].isna().all()